@@ -1,13 +1,25 @@
 """Flow2API - Main Entry Point"""
+import sys
+
+# Windows consoles may not default to UTF-8; startup output contains emoji/CJK.
+# reconfigure() switches the existing stream in place instead of re-wrapping it.
+if sys.platform == "win32" and (getattr(sys.stdout, "encoding", None) or "").lower() != "utf-8":
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+
 from src.main import app
 import uvicorn
 
 if __name__ == "__main__":
     from src.core.config import config
 
+    # uvloop/httptools ship with uvicorn[standard] but uvloop is unavailable on Windows
+    server_options = {} if sys.platform == "win32" else {"loop": "uvloop", "http": "httptools"}
+
     uvicorn.run(
-        "src.main:app",
+        app,
         host=config.server_host,
         port=config.server_port,
-        reload=False
+        reload=False,
+        **server_options
     )
@@ -839,7 +839,8 @@ async def update_captcha_config(
     token: str = Depends(verify_admin_token)
 ):
     """Update captcha configuration"""
-    from ..services.browser_captcha import validate_browser_proxy_url
+    from ..services.browser_captcha import BrowserCaptchaService, validate_browser_proxy_url
+    from ..services.browser_captcha_personal import BrowserCaptchaService as PersonalBrowserCaptchaService
 
     captcha_method = request.get("captcha_method")
     yescaptcha_api_key = request.get("yescaptcha_api_key")
@@ -864,6 +865,11 @@ async def update_captcha_config(
     # 🔥 Hot reload: sync database config to memory
     await db.reload_config_to_memory()
 
+    # 浏览器代理配置可能已变更，使浏览器服务缓存的代理配置失效
+    for browser_service in (BrowserCaptchaService._instance, PersonalBrowserCaptchaService._instance):
+        if browser_service:
+            browser_service.invalidate_proxy_cache()
+
     return {"success": True, "message": "验证码配置更新成功"}
 
 
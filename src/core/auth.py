@@ -1,4 +1,5 @@
 """Authentication module"""
+import hmac
 import bcrypt
 from typing import Optional
 from fastapi import HTTPException, Security
@@ -13,13 +14,15 @@ class AuthManager:
     @staticmethod
     def verify_api_key(api_key: str) -> bool:
         """Verify API key"""
-        return api_key == config.api_key
+        return api_key in config.api_keys
 
     @staticmethod
     def verify_admin(username: str, password: str) -> bool:
         """Verify admin credentials"""
         # Compare with current config (which may be from database or config file)
-        return username == config.admin_username and password == config.admin_password
+        username_ok = hmac.compare_digest(username.encode(), config.admin_username.encode())
+        password_ok = hmac.compare_digest(password.encode(), config.admin_password.encode())
+        return username_ok and password_ok
 
     @staticmethod
     def hash_password(password: str) -> str:
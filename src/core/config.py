@@ -10,6 +10,7 @@ class Config:
         self._config = self._load_config()
         self._admin_username: Optional[str] = None
         self._admin_password: Optional[str] = None
+        self._rebuild_api_keys()
 
     def _load_config(self) -> Dict[str, Any]:
         """Load configuration from setting.toml"""
@@ -20,6 +21,7 @@ class Config:
     def reload_config(self):
         """Reload configuration from file"""
         self._config = self._load_config()
+        self._rebuild_api_keys()
 
     def get_raw_config(self) -> Dict[str, Any]:
         """Get raw configuration dictionary"""
@@ -100,6 +102,16 @@ class Config:
     @api_key.setter
     def api_key(self, value: str):
         self._config["global"]["api_key"] = value
+        self._rebuild_api_keys()
+
+    @property
+    def api_keys(self) -> frozenset:
+        """Valid API keys as a lookup set (rebuilt whenever api_key changes)"""
+        return self._api_keys
+
+    def _rebuild_api_keys(self):
+        """Rebuild the API key lookup set from the current api_key"""
+        self._api_keys = frozenset(key for key in (self.api_key,) if key)
 
     @property
     def admin_password(self) -> str:
@@ -230,20 +230,28 @@ class DebugLogger:
         except Exception as e:
             self.logger.error(f"Error logging error: {e}")
 
-    def log_info(self, message: str):
-        """Log general info message to log.txt"""
+    def is_debug_enabled(self) -> bool:
+        """Whether debug logging is currently enabled"""
+        return config.debug_enabled
+
+    def log_info(self, message: str, *args):
+        """Log general info message to log.txt (args are %-formatted lazily)"""
         if not config.debug_enabled:
             return
         try:
+            if args:
+                message = message % args
             self.logger.info(f"ℹ️  [{self._format_timestamp()}] {message}")
         except Exception as e:
             self.logger.error(f"Error logging info: {e}")
 
-    def log_warning(self, message: str):
-        """Log warning message to log.txt"""
+    def log_warning(self, message: str, *args):
+        """Log warning message to log.txt (args are %-formatted lazily)"""
         if not config.debug_enabled:
             return
         try:
+            if args:
+                message = message % args
             self.logger.warning(f"⚠️  [{self._format_timestamp()}] {message}")
         except Exception as e:
             self.logger.error(f"Error logging warning: {e}")
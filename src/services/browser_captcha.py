@@ -3,14 +3,86 @@
 使用 Playwright 访问页面并执行 reCAPTCHA 验证
 """
 import asyncio
+import functools
+import os
 import time
-import re
 from typing import Optional, Dict
+from urllib.parse import urlsplit
 from playwright.async_api import async_playwright, Browser, BrowserContext
+from playwright.async_api import Error as PlaywrightError
 
 from ..core.logger import debug_logger
 
 
+_PROXY_SCHEMES = ('socks5', 'http', 'https')
+
+# 获取 reCAPTCHA token 不需要的资源类型，加载页面时直接拦截
+_BLOCKED_RESOURCE_TYPES = frozenset({'image', 'media', 'font', 'stylesheet'})
+
+# 检查/注入 reCAPTCHA v3 脚本 -> 等待初始化 -> 执行，参数为 websiteKey
+_RECAPTCHA_TOKEN_JS = """
+async (websiteKey) => {
+    const isReady = () => window.grecaptcha &&
+        typeof window.grecaptcha.execute === 'function';
+
+    try {
+        // 检查并注入 reCAPTCHA v3 脚本
+        if (!isReady()) {
+            // 页面仅完成 commit，文档可能尚未解析出 <html>
+            if (!document.documentElement) {
+                await new Promise((resolve) => document.addEventListener(
+                    'DOMContentLoaded', resolve, { once: true }));
+            }
+            await new Promise((resolve) => {
+                const script = document.createElement('script');
+                script.src = `https://www.google.com/recaptcha/api.js?render=${websiteKey}`;
+                script.async = true;
+                script.defer = true;
+                script.onload = () => resolve(true);
+                script.onerror = () => resolve(false);
+                (document.head || document.documentElement).appendChild(script);
+            });
+        }
+
+        // 等待reCAPTCHA加载和初始化（最多10秒）
+        const deadline = Date.now() + 10000;
+        while (!isReady() && Date.now() < deadline) {
+            await new Promise((resolve) => setTimeout(resolve, 100));
+        }
+        if (!isReady()) {
+            console.error('[BrowserCaptcha] reCAPTCHA 初始化超时');
+            return null;
+        }
+
+        // 确保grecaptcha已准备好
+        await new Promise((resolve, reject) => {
+            const timeout = setTimeout(() => {
+                reject(new Error('reCAPTCHA加载超时'));
+            }, 15000);
+
+            if (window.grecaptcha.ready) {
+                window.grecaptcha.ready(() => {
+                    clearTimeout(timeout);
+                    resolve();
+                });
+            } else {
+                clearTimeout(timeout);
+                resolve();
+            }
+        });
+
+        // 执行reCAPTCHA v3
+        return await window.grecaptcha.execute(websiteKey, {
+            action: 'FLOW_GENERATION'
+        });
+    } catch (error) {
+        console.error('[BrowserCaptcha] reCAPTCHA执行错误:', error);
+        return null;
+    }
+}
+"""
+
+
 def parse_proxy_url(proxy_url: str) -> Optional[Dict[str, str]]:
     """解析代理URL，分离协议、主机、端口、认证信息
 
@@ -20,19 +92,43 @@ def parse_proxy_url(proxy_url: str) -> Optional[Dict[str, str]]:
     Returns:
         代理配置字典，包含server、username、password（如果有认证）
     """
-    proxy_pattern = r'^(socks5|http|https)://(?:([^:]+):([^@]+)@)?([^:]+):(\d+)$'
-    match = re.match(proxy_pattern, proxy_url)
+    if not proxy_url:
+        return None
 
-    if match:
-        protocol, username, password, host, port = match.groups()
-        proxy_config = {'server': f'{protocol}://{host}:{port}'}
+    try:
+        parts = urlsplit(proxy_url)
+        port = parts.port
+    except ValueError:
+        return None
 
-        if username and password:
-            proxy_config['username'] = username
-            proxy_config['password'] = password
+    if parts.scheme not in _PROXY_SCHEMES or not parts.hostname or not port:
+        return None
+    if parts.path or parts.query or parts.fragment:
+        return None
 
-        return proxy_config
-    return None
+    # 从 netloc 取主机部分，保留 IPv6 地址的方括号（hostname 会去掉方括号）
+    host = parts.netloc.rpartition('@')[2].rpartition(':')[0]
+    proxy_config = {'server': f'{parts.scheme}://{host}:{port}'}
+
+    if parts.username and parts.password:
+        proxy_config['username'] = parts.username
+        proxy_config['password'] = parts.password
+
+    return proxy_config
+
+
+async def _block_heavy_resources(route, request):
+    """拦截图片/媒体/字体/样式请求（reCAPTCHA 自身的资源除外）"""
+    if request.resource_type in _BLOCKED_RESOURCE_TYPES and 'recaptcha' not in request.url:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+@functools.lru_cache(maxsize=4)
+def _parse_proxy_cached(proxy_url: str) -> Optional[Dict[str, str]]:
+    """带缓存的 parse_proxy_url（返回的字典为共享对象，调用方不可修改）"""
+    return parse_proxy_url(proxy_url)
 
 
 def validate_browser_proxy_url(proxy_url: str) -> tuple[bool, str]:
@@ -48,7 +144,7 @@ def validate_browser_proxy_url(proxy_url: str) -> tuple[bool, str]:
         return True, ""  # 空URL视为有效（不使用代理）
 
     proxy_url = proxy_url.strip()
-    parsed = parse_proxy_url(proxy_url)
+    parsed = _parse_proxy_cached(proxy_url)
 
     if not parsed:
         return False, "代理URL格式错误，正确格式：http://host:port 或 socks5://host:port"
@@ -57,7 +153,8 @@ def validate_browser_proxy_url(proxy_url: str) -> tuple[bool, str]:
     has_auth = 'username' in parsed
 
     # 获取协议
-    protocol = parsed['server'].split('://')[0]
+    server = parsed['server']
+    protocol = server[:server.index('://')]
 
     # SOCKS5不支持认证
     if protocol == 'socks5' and has_auth:
@@ -78,70 +175,107 @@ class BrowserCaptchaService:
     """浏览器自动化获取 reCAPTCHA token（单例模式）"""
 
     _instance: Optional['BrowserCaptchaService'] = None
-    _lock = asyncio.Lock()
+    _lock: Optional[asyncio.Lock] = None
 
     def __init__(self, db=None):
-        """初始化服务（始终使用无头模式）"""
-        self.headless = True  # 始终无头
+        """初始化服务（默认无头模式，设置 FLOW2API_HEADFUL=1 可切换为有头模式调试）"""
+        self.headless = os.environ.get("FLOW2API_HEADFUL") != "1"
         self.playwright = None
         self.browser: Optional[Browser] = None
         self._initialized = False
+        self._init_lock = asyncio.Lock()
         self.website_key = "6LdsFiUsAAAAAIjVDZcuLhaHiDn5nnHVXVRQGeMV"
         self.db = db
+        # 浏览器代理配置缓存，避免每次（重新）启动浏览器都查询数据库
+        self._cached_proxy_url: Optional[str] = None
+        self._proxy_cached_at = 0.0
+        self._proxy_cache_ttl = 60
+
+    @classmethod
+    def _get_lock(cls) -> asyncio.Lock:
+        """懒加载单例锁，避免在导入时绑定事件循环"""
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        return cls._lock
 
     @classmethod
     async def get_instance(cls, db=None) -> 'BrowserCaptchaService':
-        """获取单例实例"""
-        if cls._instance is None:
-            async with cls._lock:
-                if cls._instance is None:
-                    cls._instance = cls(db)
-                    await cls._instance.initialize()
+        """获取单例实例（已初始化时直接返回，不经过锁）"""
+        instance = cls._instance
+        if instance is not None and instance._initialized:
+            return instance
+
+        async with cls._get_lock():
+            if cls._instance is None:
+                cls._instance = cls(db)
+            if not cls._instance._initialized:
+                await cls._instance.initialize()
         return cls._instance
 
+    async def _get_browser_proxy_url(self) -> Optional[str]:
+        """获取浏览器专用代理URL（缓存60秒，管理端更新配置后失效）"""
+        now = time.monotonic()
+        if self._proxy_cached_at and now - self._proxy_cached_at < self._proxy_cache_ttl:
+            return self._cached_proxy_url
+
+        proxy_url = None
+        if self.db:
+            captcha_config = await self.db.get_captcha_config()
+            if captcha_config.browser_proxy_enabled and captcha_config.browser_proxy_url:
+                proxy_url = captcha_config.browser_proxy_url
+
+        self._cached_proxy_url = proxy_url
+        self._proxy_cached_at = now
+        return proxy_url
+
+    def invalidate_proxy_cache(self):
+        """使缓存的代理配置失效（下次启动浏览器时重新读取）"""
+        self._proxy_cached_at = 0.0
+
     async def initialize(self):
         """初始化浏览器（启动一次）"""
         if self._initialized:
             return
 
-        try:
-            # 获取浏览器专用代理配置
-            proxy_url = None
-            if self.db:
-                captcha_config = await self.db.get_captcha_config()
-                if captcha_config.browser_proxy_enabled and captcha_config.browser_proxy_url:
-                    proxy_url = captcha_config.browser_proxy_url
-
-            debug_logger.log_info(f"[BrowserCaptcha] 正在启动浏览器... (proxy={proxy_url or 'None'})")
-            self.playwright = await async_playwright().start()
-
-            # 配置浏览器启动参数
-            launch_options = {
-                'headless': self.headless,
-                'args': [
-                    '--disable-blink-features=AutomationControlled',
-                    '--disable-dev-shm-usage',
-                    '--no-sandbox',
-                    '--disable-setuid-sandbox'
-                ]
-            }
+        async with self._init_lock:
+            if self._initialized:
+                return
 
-            # 如果有代理，解析并添加代理配置
-            if proxy_url:
-                proxy_config = parse_proxy_url(proxy_url)
-                if proxy_config:
-                    launch_options['proxy'] = proxy_config
-                    auth_info = "auth=yes" if 'username' in proxy_config else "auth=no"
-                    debug_logger.log_info(f"[BrowserCaptcha] 代理配置: {proxy_config['server']} ({auth_info})")
-                else:
-                    debug_logger.log_warning(f"[BrowserCaptcha] 代理URL格式错误: {proxy_url}")
-
-            self.browser = await self.playwright.chromium.launch(**launch_options)
-            self._initialized = True
-            debug_logger.log_info(f"[BrowserCaptcha] ✅ 浏览器已启动 (headless={self.headless}, proxy={proxy_url or 'None'})")
-        except Exception as e:
-            debug_logger.log_error(f"[BrowserCaptcha] ❌ 浏览器启动失败: {str(e)}")
-            raise
+            try:
+                # 获取浏览器专用代理配置
+                proxy_url = await self._get_browser_proxy_url()
+
+                debug_logger.log_info(f"[BrowserCaptcha] 正在启动浏览器... (proxy={proxy_url or 'None'})")
+                self.playwright = await async_playwright().start()
+
+                # 配置浏览器启动参数
+                # channel='chromium' 在无头模式下使用新版 headless（完整 Chromium），
+                # 指纹与有头模式一致，而不是 chromium-headless-shell
+                launch_options = {
+                    'headless': self.headless,
+                    'channel': 'chromium',
+                    'args': [
+                        '--disable-blink-features=AutomationControlled',
+                        '--disable-dev-shm-usage'
+                    ]
+                }
+
+                # 如果有代理，解析并添加代理配置
+                if proxy_url:
+                    proxy_config = _parse_proxy_cached(proxy_url)
+                    if proxy_config:
+                        launch_options['proxy'] = dict(proxy_config)
+                        auth_info = "auth=yes" if 'username' in proxy_config else "auth=no"
+                        debug_logger.log_info(f"[BrowserCaptcha] 代理配置: {proxy_config['server']} ({auth_info})")
+                    else:
+                        debug_logger.log_warning(f"[BrowserCaptcha] 代理URL格式错误: {proxy_url}")
+
+                self.browser = await self.playwright.chromium.launch(**launch_options)
+                self._initialized = True
+                debug_logger.log_info(f"[BrowserCaptcha] ✅ 浏览器已启动 (headless={self.headless}, proxy={proxy_url or 'None'})")
+            except Exception as e:
+                debug_logger.log_error(f"[BrowserCaptcha] ❌ 浏览器启动失败: {str(e)}")
+                raise
 
     async def get_token(self, project_id: str) -> Optional[str]:
         """获取 reCAPTCHA token
@@ -166,114 +300,29 @@ class BrowserCaptchaService:
                 locale='en-US',
                 timezone_id='America/New_York'
             )
+            await context.route("**/*", _block_heavy_resources)
             page = await context.new_page()
 
             website_url = f"https://labs.google/fx/tools/flow/project/{project_id}"
 
-            debug_logger.log_info(f"[BrowserCaptcha] 访问页面: {website_url}")
+            debug_logger.log_info("[BrowserCaptcha] 访问页面: %s", website_url)
 
             # 访问页面
             try:
-                await page.goto(website_url, wait_until="domcontentloaded", timeout=30000)
+                await page.goto(website_url, wait_until="commit", timeout=30000)
             except Exception as e:
-                debug_logger.log_warning(f"[BrowserCaptcha] 页面加载超时或失败: {str(e)}")
-
-            # 检查并注入 reCAPTCHA v3 脚本
-            debug_logger.log_info("[BrowserCaptcha] 检查并加载 reCAPTCHA v3 脚本...")
-            script_loaded = await page.evaluate("""
-                () => {
-                    if (window.grecaptcha && typeof window.grecaptcha.execute === 'function') {
-                        return true;
-                    }
-                    return false;
-                }
-            """)
-
-            if not script_loaded:
-                # 注入脚本
-                debug_logger.log_info("[BrowserCaptcha] 注入 reCAPTCHA v3 脚本...")
-                await page.evaluate(f"""
-                    () => {{
-                        return new Promise((resolve) => {{
-                            const script = document.createElement('script');
-                            script.src = 'https://www.google.com/recaptcha/api.js?render={self.website_key}';
-                            script.async = true;
-                            script.defer = true;
-                            script.onload = () => resolve(true);
-                            script.onerror = () => resolve(false);
-                            document.head.appendChild(script);
-                        }});
-                    }}
-                """)
-
-            # 等待reCAPTCHA加载和初始化
-            debug_logger.log_info("[BrowserCaptcha] 等待reCAPTCHA初始化...")
-            for i in range(20):
-                grecaptcha_ready = await page.evaluate("""
-                    () => {
-                        return window.grecaptcha &&
-                               typeof window.grecaptcha.execute === 'function';
-                    }
-                """)
-                if grecaptcha_ready:
-                    debug_logger.log_info(f"[BrowserCaptcha] reCAPTCHA 已准备好（等待了 {i*0.5} 秒）")
-                    break
-                await asyncio.sleep(0.5)
-            else:
-                debug_logger.log_warning("[BrowserCaptcha] reCAPTCHA 初始化超时，继续尝试执行...")
-
-            # 额外等待确保完全初始化
-            await page.wait_for_timeout(1000)
-
-            # 执行reCAPTCHA并获取token
-            debug_logger.log_info("[BrowserCaptcha] 执行reCAPTCHA验证...")
-            token = await page.evaluate("""
-                async (websiteKey) => {
-                    try {
-                        if (!window.grecaptcha) {
-                            console.error('[BrowserCaptcha] window.grecaptcha 不存在');
-                            return null;
-                        }
-
-                        if (typeof window.grecaptcha.execute !== 'function') {
-                            console.error('[BrowserCaptcha] window.grecaptcha.execute 不是函数');
-                            return null;
-                        }
-
-                        // 确保grecaptcha已准备好
-                        await new Promise((resolve, reject) => {
-                            const timeout = setTimeout(() => {
-                                reject(new Error('reCAPTCHA加载超时'));
-                            }, 15000);
-
-                            if (window.grecaptcha && window.grecaptcha.ready) {
-                                window.grecaptcha.ready(() => {
-                                    clearTimeout(timeout);
-                                    resolve();
-                                });
-                            } else {
-                                clearTimeout(timeout);
-                                resolve();
-                            }
-                        });
-
-                        // 执行reCAPTCHA v3
-                        const token = await window.grecaptcha.execute(websiteKey, {
-                            action: 'FLOW_GENERATION'
-                        });
-
-                        return token;
-                    } catch (error) {
-                        console.error('[BrowserCaptcha] reCAPTCHA执行错误:', error);
-                        return null;
-                    }
-                }
-            """, self.website_key)
+                debug_logger.log_warning("[BrowserCaptcha] 页面加载超时或失败: %s", e)
+
+            # 一次 evaluate 完成：检查/注入脚本 -> 等待初始化 -> 执行 reCAPTCHA
+            debug_logger.log_info("[BrowserCaptcha] 加载并执行reCAPTCHA验证...")
+            token = await asyncio.wait_for(
+                page.evaluate(_RECAPTCHA_TOKEN_JS, self.website_key), timeout=30
+            )
 
             duration_ms = (time.time() - start_time) * 1000
 
             if token:
-                debug_logger.log_info(f"[BrowserCaptcha] ✅ Token获取成功（耗时 {duration_ms:.0f}ms）")
+                debug_logger.log_info("[BrowserCaptcha] ✅ Token获取成功（耗时 %.0fms）", duration_ms)
                 return token
             else:
                 debug_logger.log_error("[BrowserCaptcha] Token获取失败（返回null）")
@@ -287,7 +336,7 @@ class BrowserCaptchaService:
             if context:
                 try:
                     await context.close()
-                except:
+                except PlaywrightError:
                     pass
 
     async def close(self):
@@ -295,8 +344,14 @@ class BrowserCaptchaService:
         try:
             if self.browser:
                 try:
+                    # 先关闭残留的上下文及其标签页，再关闭浏览器
+                    for context in list(self.browser.contexts):
+                        try:
+                            await context.close()
+                        except PlaywrightError:
+                            continue
                     await self.browser.close()
-                except Exception as e:
+                except (PlaywrightError, ConnectionResetError) as e:
                     # 忽略连接关闭错误（正常关闭场景）
                     if "Connection closed" not in str(e):
                         debug_logger.log_warning(f"[BrowserCaptcha] 关闭浏览器时出现异常: {str(e)}")
@@ -306,8 +361,8 @@ class BrowserCaptchaService:
             if self.playwright:
                 try:
                     await self.playwright.stop()
-                except Exception:
-                    pass  # 静默处理 playwright 停止异常
+                except (PlaywrightError, ConnectionResetError) as e:
+                    debug_logger.log_warning(f"[BrowserCaptcha] 停止 Playwright 时出现异常: {str(e)}")
                 finally:
                     self.playwright = None
 
@@ -1,31 +1,61 @@
 import asyncio
 import time
-import re
 import os
 from typing import Optional, Dict
 from playwright.async_api import async_playwright, BrowserContext, Page
+from playwright.async_api import Error as PlaywrightError
 
 from ..core.logger import debug_logger
+# 与管理端校验共用同一个代理URL解析器，保证校验通过的代理在启动时同样可用
+from .browser_captcha import _parse_proxy_cached
+
+# reCAPTCHA 相关页面脚本（websiteKey 通过 evaluate 参数传入）
+# 检查/注入 reCAPTCHA v3 脚本 -> 等待初始化 -> 执行，一次 evaluate 完成
+_RECAPTCHA_LOAD_AND_EXECUTE_JS = """
+async (websiteKey) => {
+    const isReady = () => !!(window.grecaptcha && window.grecaptcha.execute);
+    try {
+        if (!isReady()) {
+            // 页面仅完成 commit，文档可能尚未解析出 <html>
+            if (!document.documentElement) {
+                await new Promise((resolve) => document.addEventListener(
+                    'DOMContentLoaded', resolve, { once: true }));
+            }
+            await new Promise((resolve, reject) => {
+                const script = document.createElement('script');
+                script.src = `https://www.google.com/recaptcha/api.js?render=${websiteKey}`;
+                script.async = true; script.defer = true;
+                script.onload = resolve;
+                script.onerror = () => reject(new Error('reCAPTCHA 脚本加载失败'));
+                (document.head || document.documentElement).appendChild(script);
+            });
+            // 等待 grecaptcha 就绪（最多10秒；后台标签页不触发 rAF，使用定时器轮询）
+            const deadline = Date.now() + 10000;
+            while (!isReady()) {
+                if (Date.now() > deadline) throw new Error('reCAPTCHA 初始化超时');
+                await new Promise((resolve) => setTimeout(resolve, 50));
+            }
+        }
+        await new Promise((resolve) => window.grecaptcha.ready(resolve));
+        return await window.grecaptcha.execute(websiteKey, { action: 'FLOW_GENERATION' });
+    } catch (e) { return null; }
+}
+"""
+
+_RECAPTCHA_EXECUTE_JS = """
+async (websiteKey) => {
+    try {
+        return await window.grecaptcha.execute(websiteKey, { action: 'FLOW_GENERATION' });
+    } catch (e) { return null; }
+}
+"""
 
-# ... (保持原来的 parse_proxy_url 和 validate_browser_proxy_url 函数不变) ...
-def parse_proxy_url(proxy_url: str) -> Optional[Dict[str, str]]:
-    """解析代理URL，分离协议、主机、端口、认证信息"""
-    proxy_pattern = r'^(socks5|http|https)://(?:([^:]+):([^@]+)@)?([^:]+):(\d+)$'
-    match = re.match(proxy_pattern, proxy_url)
-    if match:
-        protocol, username, password, host, port = match.groups()
-        proxy_config = {'server': f'{protocol}://{host}:{port}'}
-        if username and password:
-            proxy_config['username'] = username
-            proxy_config['password'] = password
-        return proxy_config
-    return None
 
 class BrowserCaptchaService:
     """浏览器自动化获取 reCAPTCHA token（持久化有头模式）"""
 
     _instance: Optional['BrowserCaptchaService'] = None
-    _lock = asyncio.Lock()
+    _lock: Optional[asyncio.Lock] = None
 
     def __init__(self, db=None):
         """初始化服务"""
@@ -35,33 +65,76 @@ class BrowserCaptchaService:
         # 注意: 持久化模式下，我们操作的是 context 而不是 browser
         self.context: Optional[BrowserContext] = None 
         self._initialized = False
+        self._init_lock = asyncio.Lock()
         self.website_key = "6LdsFiUsAAAAAIjVDZcuLhaHiDn5nnHVXVRQGeMV"
         self.db = db
+        # 浏览器代理配置缓存，避免每次（重新）启动浏览器都查询数据库
+        self._cached_proxy_url: Optional[str] = None
+        self._proxy_cached_at = 0.0
+        self._proxy_cache_ttl = 60
         
         # === 修改点 2: 指定本地数据存储目录 ===
         # 这会在脚本运行目录下生成 browser_data 文件夹，用于保存你的登录状态
         self.user_data_dir = os.path.join(os.getcwd(), "browser_data")
 
+        # 复用的标签页池，避免每次请求都新建/关闭标签页
+        self._page_pool: Optional[asyncio.Queue] = None
+        self._page_pool_size = 4
+        # 标签页加载项目页面的时间，超过 _page_ttl 秒后刷新页面
+        self._page_loaded_at: Dict[Page, float] = {}
+        self._page_ttl = 600
+
+    @classmethod
+    def _get_lock(cls) -> asyncio.Lock:
+        """懒加载单例锁，避免在导入时绑定事件循环"""
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        return cls._lock
+
     @classmethod
     async def get_instance(cls, db=None) -> 'BrowserCaptchaService':
         if cls._instance is None:
-            async with cls._lock:
+            async with cls._get_lock():
                 if cls._instance is None:
                     cls._instance = cls(db)
                     # 首次调用不强制初始化，等待 get_token 时懒加载，或者可以在这里await
         return cls._instance
 
+    async def _get_browser_proxy_url(self) -> Optional[str]:
+        """获取浏览器专用代理URL（缓存60秒，管理端更新配置后失效）"""
+        now = time.monotonic()
+        if self._proxy_cached_at and now - self._proxy_cached_at < self._proxy_cache_ttl:
+            return self._cached_proxy_url
+
+        proxy_url = None
+        if self.db:
+            captcha_config = await self.db.get_captcha_config()
+            if captcha_config.browser_proxy_enabled and captcha_config.browser_proxy_url:
+                proxy_url = captcha_config.browser_proxy_url
+
+        self._cached_proxy_url = proxy_url
+        self._proxy_cached_at = now
+        return proxy_url
+
+    def invalidate_proxy_cache(self):
+        """使缓存的代理配置失效（下次启动浏览器时重新读取）"""
+        self._proxy_cached_at = 0.0
+
     async def initialize(self):
         """初始化持久化浏览器上下文"""
         if self._initialized and self.context:
             return
 
+        async with self._init_lock:
+            if self._initialized and self.context:
+                return
+            await self._launch()
+
+    async def _launch(self):
+        """启动浏览器并创建持久化上下文（调用方需持有 _init_lock）"""
         try:
-            proxy_url = None
-            if self.db:
-                captcha_config = await self.db.get_captcha_config()
-                if captcha_config.browser_proxy_enabled and captcha_config.browser_proxy_url:
-                    proxy_url = captcha_config.browser_proxy_url
+            # 获取浏览器专用代理配置
+            proxy_url = await self._get_browser_proxy_url()
 
             debug_logger.log_info(f"[BrowserCaptcha] 正在启动浏览器 (用户数据目录: {self.user_data_dir})...")
             self.playwright = await async_playwright().start()
@@ -73,33 +146,45 @@ class BrowserCaptchaService:
                 'viewport': {'width': 1280, 'height': 720}, # 设置默认窗口大小
                 'args': [
                     '--disable-blink-features=AutomationControlled',
-                    '--disable-infobars',
-                    '--no-sandbox',
-                    '--disable-setuid-sandbox',
                 ]
             }
 
             # 代理配置
             if proxy_url:
-                proxy_config = parse_proxy_url(proxy_url)
+                proxy_config = _parse_proxy_cached(proxy_url)
                 if proxy_config:
-                    launch_options['proxy'] = proxy_config
+                    launch_options['proxy'] = dict(proxy_config)
                     debug_logger.log_info(f"[BrowserCaptcha] 使用代理: {proxy_config['server']}")
+                else:
+                    debug_logger.log_warning(f"[BrowserCaptcha] 代理URL格式错误: {proxy_url}")
 
             # === 修改点 3: 使用 launch_persistent_context ===
             # 这会启动一个带有状态的浏览器窗口
             self.context = await self.playwright.chromium.launch_persistent_context(**launch_options)
-            
+
             # 设置默认超时
             self.context.set_default_timeout(30000)
 
+            # 预热一个标签页放入池中
+            self._page_pool = asyncio.Queue(maxsize=self._page_pool_size)
+            self._page_pool.put_nowait(await self.context.new_page())
+
             self._initialized = True
             debug_logger.log_info(f"[BrowserCaptcha] ✅ 浏览器已启动 (Profile: {self.user_data_dir})")
-            
+
         except Exception as e:
             debug_logger.log_error(f"[BrowserCaptcha] ❌ 浏览器启动失败: {str(e)}")
             raise
 
+    async def _relaunch(self, stale_context: Optional[BrowserContext]):
+        """上下文失效后重建浏览器；并发请求同时发现失效时只重建一次"""
+        async with self._init_lock:
+            # 其他请求可能已经重建过，只关闭仍是失效上下文的那一个
+            if self.context is stale_context:
+                await self.close()
+            if not (self._initialized and self.context):
+                await self._launch()
+
     async def get_token(self, project_id: str) -> Optional[str]:
         """获取 reCAPTCHA token"""
         # 确保浏览器已启动
@@ -108,54 +193,62 @@ class BrowserCaptchaService:
 
         start_time = time.time()
         page: Optional[Page] = None
+        reusable = False
 
         try:
-            # === 修改点 4: 在现有上下文中新建标签页，而不是新建上下文 ===
-            # 这样可以复用该上下文中已保存的 Cookie (你的登录状态)
-            page = await self.context.new_page()
-
             website_url = f"https://labs.google/fx/tools/flow/project/{project_id}"
-            debug_logger.log_info(f"[BrowserCaptcha] 访问页面: {website_url}")
 
-            # 访问页面
+            # === 修改点 4: 在现有上下文中取用标签页，而不是新建上下文 ===
+            # 这样可以复用该上下文中已保存的 Cookie (你的登录状态)
+            # 不预先探测上下文是否存活，取用标签页失败时再重建浏览器并重试一次
+            context = self.context
             try:
-                await page.goto(website_url, wait_until="domcontentloaded")
-            except Exception as e:
-                debug_logger.log_warning(f"[BrowserCaptcha] 页面加载警告: {str(e)}")
+                page = await self._acquire_page(website_url)
+            except PlaywrightError as e:
+                debug_logger.log_warning("[BrowserCaptcha] 浏览器上下文已失效，正在重新初始化: %s", e)
+                await self._relaunch(context)
+                page = await self._acquire_page(website_url)
+
+            # 标签页已停留在同一项目页面时跳过导航，直接复用已加载的 grecaptcha
+            # （池中的标签页都是上次成功获取过 token 的，grecaptcha 必然已就绪）
+            loaded_at = self._page_loaded_at.get(page)
+            warm = False
+            if not page.url.startswith(website_url):
+                debug_logger.log_info("[BrowserCaptcha] 访问页面: %s", website_url)
+                try:
+                    await page.goto(website_url, wait_until="commit")
+                except Exception as e:
+                    debug_logger.log_warning("[BrowserCaptcha] 页面加载警告: %s", e)
+                self._page_loaded_at[page] = time.monotonic()
+            elif loaded_at is None or time.monotonic() - loaded_at > self._page_ttl:
+                debug_logger.log_info("[BrowserCaptcha] 页面复用超时，刷新页面: %s", website_url)
+                try:
+                    await page.reload(wait_until="commit")
+                except Exception as e:
+                    debug_logger.log_warning("[BrowserCaptcha] 页面刷新警告: %s", e)
+                self._page_loaded_at[page] = time.monotonic()
+            else:
+                warm = True
 
             # --- 关键点：如果需要人工介入 ---
             # 你可以在这里加入一段逻辑，如果是第一次运行，或者检测到未登录，
             # 可以暂停脚本，等你手动操作完再继续。
             # 例如: await asyncio.sleep(30) 
-            
-            # ... (中间注入脚本和执行 reCAPTCHA 的代码逻辑与原版完全一致，此处省略以节省篇幅) ...
-            # ... 请将原代码中从 "检查并注入 reCAPTCHA v3 脚本" 到 token 获取部分的代码复制到这里 ...
-            
-            # 这里为了演示，简写注入逻辑（请保留你原有的完整注入逻辑）:
-            script_loaded = await page.evaluate("() => { return !!(window.grecaptcha && window.grecaptcha.execute); }")
-            if not script_loaded:
-                await page.evaluate(f"""
-                    () => {{
-                        const script = document.createElement('script');
-                        script.src = 'https://www.google.com/recaptcha/api.js?render={self.website_key}';
-                        script.async = true; script.defer = true;
-                        document.head.appendChild(script);
-                    }}
-                """)
-                # 等待加载... (保留你原有的等待循环)
-                await page.wait_for_timeout(2000) 
-
-            # 执行获取 Token (保留你原有的 execute 逻辑)
-            token = await page.evaluate(f"""
-                async () => {{
-                    try {{
-                        return await window.grecaptcha.execute('{self.website_key}', {{ action: 'FLOW_GENERATION' }});
-                    }} catch (e) {{ return null; }}
-                }}
-            """)
+
+            # 已就绪的标签页直接执行；否则一次 evaluate 完成注入、等待与执行
+            # 失败的标签页不会放回池中，下次请求会新建标签页替代
+            if warm:
+                token = await asyncio.wait_for(
+                    page.evaluate(_RECAPTCHA_EXECUTE_JS, self.website_key), timeout=30
+                )
+            else:
+                token = await asyncio.wait_for(
+                    page.evaluate(_RECAPTCHA_LOAD_AND_EXECUTE_JS, self.website_key), timeout=30
+                )
             
             if token:
-                debug_logger.log_info(f"[BrowserCaptcha] ✅ Token获取成功")
+                reusable = True
+                debug_logger.log_info("[BrowserCaptcha] ✅ Token获取成功")
                 return token
             else:
                 debug_logger.log_error("[BrowserCaptcha] Token获取失败")
@@ -165,24 +258,74 @@ class BrowserCaptchaService:
             debug_logger.log_error(f"[BrowserCaptcha] 异常: {str(e)}")
             return None
         finally:
-            # === 修改点 5: 只关闭 Page (标签页)，不关闭 Context (浏览器窗口) ===
+            # === 修改点 5: 标签页放回池中，不关闭 Context (浏览器窗口) ===
             if page:
-                try:
-                    await page.close()
-                except:
-                    pass
+                await self._release_page(page, reusable)
+
+    async def _acquire_page(self, website_url: str) -> Page:
+        """从池中取出一个标签页（优先已停留在该项目页面的），池为空时新建"""
+        idle_pages = []
+        while self._page_pool is not None:
+            try:
+                page = self._page_pool.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if page.is_closed():
+                self._page_loaded_at.pop(page, None)
+            else:
+                idle_pages.append(page)
+
+        if not idle_pages:
+            return await self.context.new_page()
+
+        selected = next((p for p in idle_pages if p.url.startswith(website_url)), idle_pages[0])
+        for page in idle_pages:
+            if page is not selected:
+                self._page_pool.put_nowait(page)
+        return selected
+
+    async def _release_page(self, page: Page, reusable: bool):
+        """将标签页放回池中；出错或池已满时关闭"""
+        if reusable and self._page_pool is not None and not page.is_closed():
+            try:
+                self._page_pool.put_nowait(page)
+                return
+            except asyncio.QueueFull:
+                pass
+        self._page_loaded_at.pop(page, None)
+        try:
+            await page.close()
+        except PlaywrightError:
+            pass
 
     async def close(self):
         """完全关闭浏览器（清理资源时调用）"""
         try:
+            self._page_pool = None
+            self._page_loaded_at.clear()
+
             if self.context:
-                await self.context.close() # 这会关闭整个浏览器窗口
-                self.context = None
-            
+                try:
+                    # 先逐个关闭标签页，再关闭整个浏览器窗口
+                    for page in list(self.context.pages):
+                        try:
+                            await page.close()
+                        except PlaywrightError:
+                            continue
+                    await self.context.close()
+                except (PlaywrightError, ConnectionResetError) as e:
+                    debug_logger.log_warning(f"[BrowserCaptcha] 关闭浏览器时出现异常: {str(e)}")
+                finally:
+                    self.context = None
+
             if self.playwright:
-                await self.playwright.stop()
-                self.playwright = None
-                
+                try:
+                    await self.playwright.stop()
+                except (PlaywrightError, ConnectionResetError) as e:
+                    debug_logger.log_warning(f"[BrowserCaptcha] 停止 Playwright 时出现异常: {str(e)}")
+                finally:
+                    self.playwright = None
+
             self._initialized = False
             debug_logger.log_info("[BrowserCaptcha] 浏览器服务已关闭")
         except Exception as e:
@@ -302,6 +302,7 @@ class GenerationHandler:
                 yield self._create_stream_chunk("初始化生成环境...\n")
 
             if not await self.token_manager.is_at_valid(token.id):
+                self.load_balancer.clear_at_valid_cache(token.id)
                 error_msg = "Token AT无效或刷新失败"
                 debug_logger.log_error(f"[GENERATION] {error_msg}")
                 if stream:
@@ -1,10 +1,15 @@
 """Load balancing module for Flow2API"""
+import asyncio
 import random
-from typing import Optional
+import time
+from typing import Dict, Optional, Tuple
 from ..core.models import Token
 from .concurrency_manager import ConcurrencyManager
 from ..core.logger import debug_logger
 
+# Models that free tier (PAYGATE_TIER_NOT_PAID) tokens cannot use
+_PAID_ONLY_MODELS = frozenset({"gemini-3.0-pro-image-landscape", "gemini-3.0-pro-image-portrait"})
+
 
 class LoadBalancer:
     """Token load balancer with random selection"""
@@ -12,6 +17,28 @@ class LoadBalancer:
     def __init__(self, token_manager, concurrency_manager: Optional[ConcurrencyManager] = None):
         self.token_manager = token_manager
         self.concurrency_manager = concurrency_manager
+        # Short-lived cache of is_at_valid results: token_id -> (checked_at, valid)
+        self._at_valid_cache: Dict[int, Tuple[float, bool]] = {}
+        self._at_valid_cache_ttl = 2.0
+        # Max tokens checked concurrently (each AT check opens its own SQLite connection)
+        self._check_batch_size = 8
+
+    async def _is_at_valid(self, token_id: int) -> bool:
+        """is_at_valid with a short TTL cache to absorb request bursts"""
+        now = time.monotonic()
+        entry = self._at_valid_cache.get(token_id)
+        if entry and now - entry[0] < self._at_valid_cache_ttl:
+            return entry[1]
+        valid = await self.token_manager.is_at_valid(token_id)
+        self._at_valid_cache[token_id] = (now, valid)
+        return valid
+
+    def clear_at_valid_cache(self, token_id: Optional[int] = None):
+        """Drop cached AT validity for one token, or for all tokens"""
+        if token_id is None:
+            self._at_valid_cache.clear()
+        else:
+            self._at_valid_cache.pop(token_id, None)
 
     async def select_token(
         self,
@@ -30,66 +57,83 @@ class LoadBalancer:
         Returns:
             Selected token or None if no available tokens
         """
-        debug_logger.log_info(f"[LOAD_BALANCER] 开始选择Token (图片生成={for_image_generation}, 视频生成={for_video_generation}, 模型={model})")
+        debug_logger.log_info("[LOAD_BALANCER] 开始选择Token (图片生成=%s, 视频生成=%s, 模型=%s)", for_image_generation, for_video_generation, model)
 
         active_tokens = await self.token_manager.get_active_tokens()
-        debug_logger.log_info(f"[LOAD_BALANCER] 获取到 {len(active_tokens)} 个活跃Token")
+        debug_logger.log_info("[LOAD_BALANCER] 获取到 %s 个活跃Token", len(active_tokens))
 
         if not active_tokens:
-            debug_logger.log_info(f"[LOAD_BALANCER] ❌ 没有活跃的Token")
+            debug_logger.log_info("[LOAD_BALANCER] ❌ 没有活跃的Token")
             return None
 
-        # Filter tokens based on generation type
-        available_tokens = []
-        filtered_reasons = {}  # 记录过滤原因
+        # 过滤原因仅在调试模式下记录
+        filtered_reasons = {} if debug_logger.is_debug_enabled() else None
 
+        # Filter tokens based on generation type (cheap flag checks first)
+        paid_only = model in _PAID_ONLY_MODELS
+        candidates = []
         for token in active_tokens:
-            # Check if token has valid AT (not expired)
-            if not await self.token_manager.is_at_valid(token.id):
-                filtered_reasons[token.id] = "AT无效或已过期"
-                continue
-
             # Filter for gemini-3.0 models (skip free tier tokens)
-            if model and model in ["gemini-3.0-pro-image-landscape", "gemini-3.0-pro-image-portrait"]:
+            if paid_only:
                 if token.user_paygate_tier == "PAYGATE_TIER_NOT_PAID":
-                    filtered_reasons[token.id] = "gemini-3.0模型不支持普通账号"
+                    if filtered_reasons is not None:
+                        filtered_reasons[token.id] = "gemini-3.0模型不支持普通账号"
                     continue
 
-            # Filter for image generation
-            if for_image_generation:
-                if not token.image_enabled:
+            if for_image_generation and not token.image_enabled:
+                if filtered_reasons is not None:
                     filtered_reasons[token.id] = "图片生成已禁用"
-                    continue
-
-                # Check concurrency limit
-                if self.concurrency_manager and not await self.concurrency_manager.can_use_image(token.id):
-                    filtered_reasons[token.id] = "图片并发已满"
-                    continue
+                continue
 
-            # Filter for video generation
-            if for_video_generation:
-                if not token.video_enabled:
+            if for_video_generation and not token.video_enabled:
+                if filtered_reasons is not None:
                     filtered_reasons[token.id] = "视频生成已禁用"
-                    continue
+                continue
 
-                # Check concurrency limit
-                if self.concurrency_manager and not await self.concurrency_manager.can_use_video(token.id):
-                    filtered_reasons[token.id] = "视频并发已满"
-                    continue
+            candidates.append(token)
 
-            available_tokens.append(token)
+        async def _check(token: Token) -> Optional[Token]:
+            """Check AT validity and concurrency limit for one token"""
+            # Check if token has valid AT (not expired)
+            if not await self._is_at_valid(token.id):
+                if filtered_reasons is not None:
+                    filtered_reasons[token.id] = "AT无效或已过期"
+                return None
+
+            # Check concurrency limit
+            if for_image_generation and self.concurrency_manager and not await self.concurrency_manager.can_use_image(token.id):
+                if filtered_reasons is not None:
+                    filtered_reasons[token.id] = "图片并发已满"
+                return None
+
+            if for_video_generation and self.concurrency_manager and not await self.concurrency_manager.can_use_video(token.id):
+                if filtered_reasons is not None:
+                    filtered_reasons[token.id] = "视频并发已满"
+                return None
+
+            return token
+
+        # Random selection: check shuffled candidates in bounded batches and
+        # pick from the first batch that has a usable token
+        random.shuffle(candidates)
+        selected = None
+        for i in range(0, len(candidates), self._check_batch_size):
+            batch = candidates[i:i + self._check_batch_size]
+            results = await asyncio.gather(*(_check(token) for token in batch))
+            available_tokens = [token for token in results if token is not None]
+            if available_tokens:
+                selected = random.choice(available_tokens)
+                break
 
         # 输出过滤信息
         if filtered_reasons:
-            debug_logger.log_info(f"[LOAD_BALANCER] 已过滤Token:")
+            debug_logger.log_info("[LOAD_BALANCER] 已过滤Token:")
             for token_id, reason in filtered_reasons.items():
-                debug_logger.log_info(f"[LOAD_BALANCER]   - Token {token_id}: {reason}")
+                debug_logger.log_info("[LOAD_BALANCER]   - Token %s: %s", token_id, reason)
 
-        if not available_tokens:
-            debug_logger.log_info(f"[LOAD_BALANCER] ❌ 没有可用的Token (图片生成={for_image_generation}, 视频生成={for_video_generation})")
+        if not selected:
+            debug_logger.log_info("[LOAD_BALANCER] ❌ 没有可用的Token (图片生成=%s, 视频生成=%s)", for_image_generation, for_video_generation)
             return None
 
-        # Random selection
-        selected = random.choice(available_tokens)
-        debug_logger.log_info(f"[LOAD_BALANCER] ✅ 已选择Token {selected.id} ({selected.email}) - 余额: {selected.credits}")
+        debug_logger.log_info("[LOAD_BALANCER] ✅ 已选择Token %s (%s) - 余额: %s", selected.id, selected.email, selected.credits)
         return selected